@@ -18,5 +18,8 @@ $CMD  -r 1215979 -w urls.txt -n
 $CMD  -r 1215979 -w -
 $CMD  10.5281/zenodo.1215979 -R 3 -p 2 -n
 $CMD  -d 10.5281/zenodo.1215979
+$CMD  -r 1215979 -j 4 -n
+$CMD  -r 1215979 -P 4 -n
+$CMD  -r 1215979 -g "*.txt" -g "*.md" -n
 
 echo "  TESTS ARE OK!  "
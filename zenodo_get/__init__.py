@@ -38,7 +38,7 @@ Zenodo. https://doi.org/"""
     + __doi__
 )
 
-try:  # wget and other libs might not be present at installation
+try:  # requests and other libs might not be present at installation
     from .zget import zenodo_get
 
     __all__ = ["zenodo_get"]
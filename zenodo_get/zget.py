@@ -1,31 +1,30 @@
 #!/usr/bin/env python3
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from contextlib import contextmanager
-from fnmatch import fnmatch
+from fnmatch import translate
+from functools import lru_cache, partial
 import hashlib
 from importlib.metadata import version
+import json
 from optparse import OptionParser
 import os
-from pathlib import Path
+import random
+import re
+from pathlib import Path, PurePosixPath
+import shutil
 import signal
 import sys
+import threading
 import time
-from urllib.parse import unquote
+from urllib.parse import unquote, urlparse
 
-import humanize
-import requests
-import wget
 import zenodo_get as zget
 
-
-# see https://stackoverflow.com/questions/431684/how-do-i-change-the-working-directory-in-python/24176022#24176022
-@contextmanager
-def cd(newdir):
-    prevdir = os.getcwd()
-    os.chdir(os.path.expanduser(newdir))
-    try:
-        yield
-    finally:
-        os.chdir(prevdir)
+try:  # optional, but considerably faster on records with many files
+    import orjson
+except ImportError:
+    orjson = None
 
 
 def eprint(*args, **kwargs):
@@ -37,21 +36,39 @@ def ctrl_c(func):
     return func
 
 
-abort_signal = False
-abort_counter = 0
+DOI_URL = "https://doi.org/"
+ZENODO_API_URL = "https://zenodo.org/api/records/"
+SANDBOX_API_URL = "https://sandbox.zenodo.org/api/records/"
+ZENODO_DOI = re.compile(r"10\.5281/zenodo\.(\d+)$", re.IGNORECASE)
+
+HASH_BLOCK_SIZE = 4 << 20
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+DROP_CACHE_SIZE = 64 << 20  # smaller files are not synced to the disk
+MIN_PART_SIZE = 8 << 20  # smaller parts are not worth another connection
+
+CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", "~/.cache")).expanduser() / "zenodo_get"
+)
+
+# HTTP errors worth retrying besides 5xx, and the longest pause between them
+RETRY_STATUS = (408, 429)
+MAX_PAUSE = 60.0
+
+# set by the first CTRL+C: no new downloads are started
+abort_signal = threading.Event()
+# set by the second CTRL+C: running downloads are stopped too
+abort_now = threading.Event()
 exceptions = False
 
 
 @ctrl_c
 def handle_ctrl_c(*args, **kwargs):
-    global abort_signal
-    global abort_counter
     global exceptions
 
-    abort_signal = True
-    abort_counter += 1
-
-    if abort_counter >= 2:
+    if not abort_signal.is_set():
+        abort_signal.set()
+    else:
+        abort_now.set()
         eprint()
         eprint("Immediate abort. There might be unfinished files.")
         if exceptions:
@@ -60,22 +77,574 @@ def handle_ctrl_c(*args, **kwargs):
             sys.exit(1)
 
 
-def check_hash(filename, checksum):
-    algorithm = "md5"
+@lru_cache(maxsize=None)
+def get_session():
+    # one session for every request, so connections are kept alive and reused
+    import requests
+
+    return requests.Session()
+
+
+@contextmanager
+def save_on_exit(path, obj):
+    # also saved when the downloads are aborted, a failed write is ignored
+    try:
+        yield obj
+    finally:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(obj))
+        except OSError:
+            pass
+
+
+def stop_downloads(futures):
+    # queued downloads are not started, running ones stop at the next chunk
+    # and leave their .part files behind
+    abort_signal.set()
+    abort_now.set()
+    for future in futures:
+        future.cancel()
+
+
+def fadvise(f, advice):
+    # access pattern hints for the page cache, only available on POSIX
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(f.fileno(), 0, 0, getattr(os, advice))
+
+
+def new_hash(algorithm):
+    # checksums are only for integrity, so MD5 also works on FIPS systems
+    if sys.version_info >= (3, 9):
+        return hashlib.new(algorithm, usedforsecurity=False)
+    return hashlib.new(algorithm)
+
+
+def update_hash(h, f):
+    fadvise(f, "POSIX_FADV_SEQUENTIAL")
+    if hasattr(hashlib, "file_digest"):  # Python 3.11+
+        return hashlib.file_digest(f, lambda: h)
+    view = memoryview(bytearray(HASH_BLOCK_SIZE))
+    while True:
+        n = f.readinto(view)
+        if not n:
+            break
+        h.update(view[:n])
+    return h
+
+
+def local_size(filename):
+    # one stat() call instead of exists() and getsize()
+    try:
+        return os.stat(filename).st_size
+    except FileNotFoundError:
+        return None
+
+
+def check_hash(filename, checksum, algorithm="md5"):
     value = checksum.strip()
-    if not os.path.exists(filename):
+    h = new_hash(algorithm)
+    try:
+        f = open(filename, "rb", buffering=0)
+    except FileNotFoundError:
         return value, "invalid"
-    h = hashlib.new(algorithm)
-    with open(filename, "rb") as f:
-        while True:
-            data = f.read(4096)
-            if not data:
-                break
-            h.update(data)
+    with f:
+        update_hash(h, f)
     digest = h.hexdigest()
     return value, digest
 
 
+def naturalsize(size):
+    # the same output as humanize.naturalsize, without importing it
+    if size == 1:
+        return "1 Byte"
+    if size < 1000:
+        return f"{size} Bytes"
+    for exp, unit in enumerate(("kB", "MB", "GB", "TB", "PB", "EB", "ZB", "YB"), 1):
+        value = size / 1000**exp
+        if round(value, 1) < 1000:  # 999.96 kB is shown as 1.0 MB
+            break
+    return f"{value:.1f} {unit}"
+
+
+def progress_bar(done, total):
+    # the layout of wget's bar:  42% [.....     ] done / total
+    width = shutil.get_terminal_size().columns - 1
+    percent = f"{100 * done // total}%".rjust(4)
+    size = f"{done} / {total}".rjust(len(str(total)) * 2 + 3)
+    dots = max(width - len(percent) - len(size) - 4, 1)
+    shaded = dots * done // total
+    return f"{percent} [{'.' * shaded}{' ' * (dots - shaded)}] {size}"
+
+
+def file_progress(n, done, total):
+    # a bar for the file which is being downloaded
+    if total:
+        sys.stdout.write("\r" + progress_bar(done, total))
+        sys.stdout.flush()
+
+
+def total_progress(total):
+    # one bar for all the parallel downloads, fed by every worker thread
+    lock = threading.Lock()
+    count = 0
+
+    def update(n, done, size):
+        nonlocal count
+        with lock:
+            count = min(count + n, total)  # retried data is counted again
+            if total:
+                sys.stdout.write("\r" + progress_bar(count, total))
+                sys.stdout.flush()
+
+    return update
+
+
+def range_matches(r, start):
+    # a partial response which starts where it was asked to
+    return r.status_code == 206 and r.headers.get("Content-Range", "").startswith(
+        f"bytes {start}-"
+    )
+
+
+def drop_ranges(part):
+    # the record of an earlier download in parts, see download_parts
+    try:
+        os.remove(part + ".ranges")
+    except FileNotFoundError:
+        pass
+
+
+def complete_part(part, fname, size, checksum, algorithm, progress):
+    # a .part file of full size, e.g. interrupted before it was renamed,
+    # is not downloaded again if its checksum is correct
+    h = new_hash(algorithm)
+    with open(part, "rb", buffering=0) as f:
+        update_hash(h, f)
+    if h.hexdigest() != checksum:
+        return None
+    os.replace(part, fname)
+    drop_ranges(part)
+    if progress is not None:
+        progress(size, size, size)
+    return h.hexdigest()
+
+
+def resume_point(fname, size, resume, checksum, algorithm, progress):
+    # the .part file of an earlier attempt: its name, the length of the data
+    # which can be continued, and the checksum, if the file is complete
+    part = os.fspath(fname) + ".part"
+    existing = local_size(part) if resume and size is not None else None
+    if checksum is not None and existing is not None and existing == size:
+        digest = complete_part(part, fname, size, checksum, algorithm, progress)
+        if digest is not None:
+            return part, size, digest
+    if existing is None or existing >= size:
+        existing = 0
+    return part, existing, None
+
+
+def download_file(
+    url,
+    fname,
+    size=None,
+    resume=True,
+    timeout=None,
+    params=None,
+    progress=file_progress,
+    algorithm="md5",
+    checksum=None,
+):
+    # the data goes to a .part file, which gets the final name when complete,
+    # and a partial download is resumed with a Range request, if possible;
+    # returns the checksum, and whether a partial file was continued
+    part, existing, digest = resume_point(
+        fname, size, resume, checksum, algorithm, progress
+    )
+    if digest is not None:
+        return digest, True
+
+    headers = {}
+    if existing > 0:
+        headers["Range"] = f"bytes={existing}-"
+
+    # the checksum is computed while the data is written, no second pass
+    h = new_hash(algorithm)
+    r = get_session().get(
+        url, params=params, headers=headers, stream=True, timeout=timeout
+    )
+    resumed = range_matches(r, existing)
+    if existing > 0 and r.status_code in (206, 416) and not resumed:
+        # the range does not fit the file on the server, get all of it
+        r.close()
+        r = get_session().get(url, params=params, stream=True, timeout=timeout)
+    with r:
+        r.raise_for_status()
+        if resumed:
+            mode = "ab"
+            done = existing
+            with open(part, "rb", buffering=0) as f:
+                update_hash(h, f)
+            if progress is not None:
+                progress(done, done, size)
+        else:  # the server ignored the range, start from scratch
+            mode = "wb"
+            done = 0
+            drop_ranges(part)
+        total = size or int(r.headers.get("Content-Length", 0)) + done
+        with open(part, mode) as f:
+            fadvise(f, "POSIX_FADV_SEQUENTIAL")
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if abort_now.is_set():  # the partial file can be resumed
+                    raise Exception("Immediate abort")
+                f.write(chunk)
+                h.update(chunk)
+                done += len(chunk)
+                if progress is not None:
+                    progress(len(chunk), done, total)
+            # the file is not read again, do not let it push out other data,
+            # but only pages which are already on the disk can be dropped
+            f.flush()
+            if done >= DROP_CACHE_SIZE and hasattr(os, "posix_fadvise"):
+                os.fdatasync(f.fileno())
+            fadvise(f, "POSIX_FADV_DONTNEED")
+    os.replace(part, fname)
+    return h.hexdigest(), resumed
+
+
+def write_range(r, fd, start, end, progress, stop):
+    # one part of a file, written at its own offset
+    with r:
+        r.raise_for_status()
+        if not range_matches(r, start):
+            raise Exception(f"Range request failed: bytes {start}-{end - 1}")
+        for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            if abort_now.is_set() or stop.is_set():
+                raise Exception("Immediate abort")
+            os.pwrite(fd, chunk, start)
+            start += len(chunk)
+            progress(len(chunk))
+    if start != end:
+        raise Exception(f"Incomplete range: bytes {start}-{end - 1}")
+
+
+def load_ranges(part, size):
+    # the ranges of an interrupted download in parts which already arrived
+    try:
+        if local_size(part) == size:
+            with open(part + ".ranges", "rb") as f:
+                return [tuple(r) for r in json.load(f)]
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def missing_ranges(done, size):
+    missing = []
+    pos = 0
+    for start, end in sorted(done):
+        if start > pos:
+            missing.append((pos, start))
+        pos = max(pos, end)
+    if pos < size:
+        missing.append((pos, size))
+    return missing
+
+
+def download_parts(
+    url,
+    fname,
+    size=None,
+    resume=True,
+    timeout=None,
+    params=None,
+    progress=file_progress,
+    algorithm="md5",
+    checksum=None,
+    parts=2,
+):
+    # a large file is downloaded as several ranges at once, which helps if
+    # the server limits the bandwidth of each connection; the finished ranges
+    # are listed in NAME.part.ranges, a retry only gets the missing ones
+    fallback = partial(
+        download_file,
+        url,
+        fname,
+        size,
+        timeout=timeout,
+        params=params,
+        progress=progress,
+        algorithm=algorithm,
+        checksum=checksum,
+    )
+    if not size or not hasattr(os, "pwrite"):
+        return fallback(resume=resume)
+    part = os.fspath(fname) + ".part"
+    done = load_ranges(part, size) if resume else None
+    existing = 0  # the length of a .part file which download_file can resume
+    if done is None:
+        part, existing, digest = resume_point(
+            fname, size, resume, checksum, algorithm, progress
+        )
+        if digest is not None:
+            return digest, True
+        done = [(0, existing)] if existing else []
+        parts = min(parts, (size - existing) // MIN_PART_SIZE)
+        if parts < 2:
+            return fallback(resume=existing > 0)
+    resumed = len(done) > 0
+
+    # the missing ranges get connections in proportion to their lengths
+    missing = missing_ranges(done, size)
+    todo = sum(end - start for start, end in missing)
+    ranges = []
+    for start, end in missing:
+        n = max(1, min(parts * (end - start) // todo, (end - start) // MIN_PART_SIZE))
+        bounds = [start + (end - start) * i // n for i in range(n + 1)]
+        ranges += zip(bounds[:-1], bounds[1:])
+
+    first = None
+    if ranges:
+        start, end = ranges[0]
+        first = get_session().get(
+            url,
+            params=params,
+            headers={"Range": f"bytes={start}-{end - 1}"},
+            stream=True,
+            timeout=timeout,
+        )
+        if not range_matches(first, start):  # the server does not support it
+            first.close()
+            return fallback(resume=existing > 0)
+
+    lock = threading.Lock()
+    count = size - todo
+    stop = threading.Event()  # set by the first failed range
+    errors = []
+
+    def update(n):
+        nonlocal count
+        with lock:
+            count += n
+            if progress is not None:
+                progress(n, count, size)
+
+    def save(start, end):
+        with lock:
+            if end > start:
+                done.append((start, end))
+            try:
+                write_atomic(Path(part + ".ranges"), json.dumps(done).encode())
+            except OSError:  # it cannot be resumed, but it can be finished
+                pass
+
+    def fetch_range(start, end, r=None):
+        written = 0
+
+        def written_now(n):
+            nonlocal written
+            written += n
+            update(n)
+
+        try:
+            if r is None:
+                r = get_session().get(
+                    url,
+                    params=params,
+                    headers={"Range": f"bytes={start}-{end - 1}"},
+                    stream=True,
+                    timeout=timeout,
+                )
+            write_range(r, fd, start, end, written_now, stop)
+        except Exception as e:
+            if not stop.is_set():  # the other ranges were only stopped
+                errors.append(e)
+                stop.set()
+        finally:
+            if written:
+                save(start, start + written)
+
+    if count and progress is not None:
+        progress(count, count, size)
+    with open(part, "r+b" if resumed else "wb") as f:
+        fd = f.fileno()
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError):  # e.g. not supported by the OS or FS
+            f.truncate(size)
+        save(0, 0)  # the gaps are known from now on, even if it is killed
+        if ranges:
+            with ThreadPoolExecutor(max_workers=max(len(ranges) - 1, 1)) as pool:
+                for r in ranges[1:]:
+                    pool.submit(fetch_range, *r)
+                fetch_range(*ranges[0], first)
+    if errors:
+        raise errors[0]
+    os.replace(part, fname)
+    drop_ranges(part)
+
+    # the parts arrive out of order, so the file is hashed afterwards
+    h = new_hash(algorithm)
+    with open(fname, "rb", buffering=0) as f:
+        update_hash(h, f)
+        fadvise(f, "POSIX_FADV_DONTNEED")
+    return h.hexdigest(), resumed
+
+
+def write_atomic(path, data):
+    # a reader never sees a half written file
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def fetch_metadata(url, recordID, params=None, timeout=None, cache_dir=None):
+    # a record which did not change since the last run is not sent again
+    headers = {}
+    if cache_dir is not None:
+        etag_file = cache_dir / f"{recordID}.etag"
+        json_file = cache_dir / f"{recordID}.json"
+        if etag_file.exists() and json_file.exists():
+            headers["If-None-Match"] = etag_file.read_text()
+
+    r = get_session().get(
+        url + recordID, params=params, headers=headers, timeout=timeout
+    )
+    content = None
+    if r.status_code == 304:
+        try:
+            content = json_file.read_bytes()
+        except OSError:  # the cache is gone since, ask for the whole record
+            r = get_session().get(url + recordID, params=params, timeout=timeout)
+    if content is None:
+        if not r.ok:
+            return None
+        content = r.content
+        if cache_dir is not None and "ETag" in r.headers:
+            try:
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                write_atomic(json_file, content)
+                write_atomic(etag_file, r.headers["ETag"].encode())
+            except OSError:  # e.g. read-only home directory
+                pass
+    return orjson.loads(content) if orjson is not None else json.loads(content)
+
+
+FileEntry = namedtuple("FileEntry", "name size algorithm checksum")
+
+
+def file_entry(f):
+    # resolve the fields which differ between API versions only once,
+    # checksums are prefixed with their algorithm, e.g. "md5:..."
+    algorithm, _, checksum = f["checksum"].rpartition(":")
+    return FileEntry(
+        name=f.get("filename") or f["key"],
+        size=f.get("filesize") or f["size"],
+        algorithm=algorithm or "md5",
+        checksum=checksum.strip(),
+    )
+
+
+def verified_cache(outdir):
+    # checksums which were already verified, one file per output directory
+    h = new_hash("md5")
+    h.update(str(outdir.resolve()).encode())
+    return CACHE_DIR / "verified" / f"{h.hexdigest()}.json"
+
+
+def file_stamp(path, checksum):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns, checksum]
+
+
+def verify_file(f, known, outdir):
+    fname = f.name
+    path = outdir / fname
+    try:
+        stamp = file_stamp(path, f.checksum)
+    except FileNotFoundError:
+        return False
+    # a shorter file is not checked, it is resumed instead
+    if stamp[0] != f.size:
+        return False
+    # an unchanged file which was verified before is not hashed again
+    if known.get(fname) == stamp:
+        return True
+    remote_hash, local_hash = check_hash(path, f.checksum, f.algorithm)
+    if remote_hash == local_hash:
+        known[fname] = stamp
+        return True
+    return False
+
+
+def fetch_file(f, recordID, options, params, verified=False, progress=file_progress):
+    fname = f.name
+    checksum = f.checksum
+    algorithm = f.algorithm
+    if abort_signal.is_set():
+        return fname, checksum, "aborted", None
+
+    link = "https://zenodo.org/records/{}/files/{}".format(recordID, fname)
+
+    size = f.size
+    eprint()
+    eprint(f"Link: {link}   size: {naturalsize(size)}")
+
+    remote_hash = checksum
+    if verified:
+        eprint(f"{fname} is already downloaded correctly.")
+        return fname, checksum, "skipped", remote_hash
+
+    link = unquote(link)
+    path = options.outdir / fname
+    resume = options.cont
+    download = download_file
+    if options.parts > 1:
+        download = partial(download_parts, parts=options.parts)
+    for attempt in range(options.retry + 1):
+        try:
+            digest, resumed = download(
+                link,
+                path,
+                size=size,
+                resume=resume,
+                timeout=options.timeout,
+                params=params,
+                progress=progress,
+                algorithm=algorithm,
+                checksum=remote_hash,
+            )
+            if resumed and digest != remote_hash:
+                # the partial file was corrupt, it cannot be resumed
+                resume = False
+                digest, _ = download(
+                    link,
+                    path,
+                    size=size,
+                    resume=resume,
+                    timeout=options.timeout,
+                    params=params,
+                    progress=progress,
+                    algorithm=algorithm,
+                )
+        except Exception as e:
+            if abort_now.is_set():
+                return fname, checksum, "aborted", None
+            eprint(f"  Download error. Original link: {link}")
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            if status in RETRY_STATUS or status is None or status >= 500:
+                if attempt < options.retry:
+                    # exponential backoff with full jitter, so that parallel
+                    # downloads do not retry in lockstep
+                    pause = min(MAX_PAUSE, options.pause * 2**attempt)
+                    time.sleep(random.uniform(0, pause))
+            else:  # e.g. 404, retrying does not help
+                break
+        else:
+            return fname, checksum, "downloaded", digest
+    return fname, checksum, "failed", None
+
+
 def zenodo_get(argv=None):
     global exceptions
 
@@ -84,6 +653,9 @@ def zenodo_get(argv=None):
         exceptions = False
     else:
         exceptions = True
+    # a previous call may have been aborted
+    abort_signal.clear()
+    abort_now.clear()
 
     parser = OptionParser(
         usage="%prog [options] RECORD_OR_DOI", version=f"%prog {version('zenodo_get')}"
@@ -124,7 +696,7 @@ def zenodo_get(argv=None):
         action="store_true",
         # ~type=bool,
         dest="md5",
-        help="Create md5sums.txt for verification.",
+        help="Create md5sums.txt for verification (integrity only, not security).",
         default=False,
     )
 
@@ -182,7 +754,8 @@ def zenodo_get(argv=None):
         action="store",
         type=float,
         dest="pause",
-        help="Wait N second before retry attempt, e.g. 0.5",
+        help="Wait up to N seconds before retry attempt, e.g. 0.5. "
+        "(Doubled after every attempt.)",
         default=0.5,
     )
 
@@ -228,14 +801,36 @@ def zenodo_get(argv=None):
     parser.add_option(
         "-g",
         "--glob",
-        action="store",
+        action="append",
         type=str,
         dest="glob",
-        default="*",
-        help="Optional glob expression for files.",
+        default=None,
+        help="Optional glob expression for files, can be given multiple times.",
+    )
+
+    parser.add_option(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        dest="jobs",
+        default=1,
+        help="Number of files downloaded in parallel. Default: 1.",
+    )
+
+    parser.add_option(
+        "-P",
+        "--parts",
+        action="store",
+        type=int,
+        dest="parts",
+        default=1,
+        help="Download large files in N parts in parallel. Default: 1.",
     )
 
     (options, args) = parser.parse_args(argv)
+    options.jobs = max(options.jobs, 1)
+    options.parts = max(options.parts, 1)
 
     if options.cite:
         print("Reference for this software:")
@@ -248,156 +843,212 @@ def zenodo_get(argv=None):
         else:
             sys.exit(0)
 
-    # create directory, if necessary, then change to it
-    options.outdir = Path(options.outdir)
-    options.outdir.mkdir(parents=True, exist_ok=True)
-    with cd(options.outdir):
-        if len(args) > 0:
-            try:
-                options.record = str(int(args[0]))
-            except ValueError:
-                options.doi = args[0]
-        elif options.doi is None and options.record is None:
-            parser.print_help()
-            if exceptions:
-                return
-            else:
-                sys.exit(0)
+    # imported only here, --help, --version and --cite are faster without it
+    import requests
 
-        if options.doi is not None:
-            url = options.doi
-            if not url.startswith("http"):
-                url = "https://doi.org/" + url
-            try:
-                r = requests.get(url, timeout=options.timeout)
-            except requests.exceptions.ConnectTimeout:
-                eprint("Connection timeout.")
-                if exceptions:
-                    raise
-                else:
-                    sys.exit(1)
-            except Exception:
-                eprint("Connection error.")
-                if exceptions:
-                    raise
-                else:
-                    sys.exit(1)
-            if not r.ok:
-                eprint("DOI could not be resolved. Try again, or use record ID.")
-                if exceptions:
-                    raise ValueError("DOI", options.doi)
-                else:
-                    sys.exit(1)
-
-            recordID = r.url.split("/")[-1]
-        else:
-            recordID = options.record
-        recordID = recordID.strip()
+    # keep a connection alive for every parallel download
+    adapter = requests.adapters.HTTPAdapter(
+        pool_maxsize=max(options.jobs * options.parts, 10)
+    )
+    get_session().mount("https://", adapter)
 
-        if not options.sandbox:
-            url = "https://zenodo.org/api/records/"
+    # create directory, if necessary, all the paths are relative to it
+    options.outdir = Path(options.outdir).expanduser()
+    options.outdir.mkdir(parents=True, exist_ok=True)
+    if len(args) > 0:
+        try:
+            options.record = str(int(args[0]))
+        except ValueError:
+            options.doi = args[0]
+    elif options.doi is None and options.record is None:
+        parser.print_help()
+        if exceptions:
+            return
         else:
-            url = "https://sandbox.zenodo.org/api/records/"
+            sys.exit(0)
+
+    url = ZENODO_API_URL if not options.sandbox else SANDBOX_API_URL
 
-        params = {}
-        if options.access_token:
-            params["access_token"] = options.access_token
+    params = {}
+    cache_dir = CACHE_DIR / ("sandbox" if options.sandbox else "zenodo")
+    if options.access_token:
+        params["access_token"] = options.access_token
+        cache_dir = None  # responses for a token are personal
+
+    # Zenodo DOIs usually contain the record ID, so the metadata can be
+    # fetched directly, without resolving the DOI first
+    js = None
+    recordID = options.record
+    if options.doi is not None and not options.sandbox:
+        match = ZENODO_DOI.search(options.doi)
+        if match:
+            try:
+                js = fetch_metadata(
+                    url,
+                    match.group(1),
+                    params=params,
+                    timeout=options.timeout,
+                    cache_dir=cache_dir,
+                )
+            except Exception:  # the DOI is resolved instead
+                pass
+            # a concept DOI gets the latest version, as from doi.org
+            doi = match.group(0).lower()
+            if js is not None and doi in (
+                str(js.get("doi")).lower(),
+                str(js["metadata"].get("doi")).lower(),
+                str(js.get("conceptdoi")).lower(),
+            ):
+                recordID = str(js["id"])
+            else:
+                js = None
 
+    if options.doi is not None and js is None:
+        doi_url = options.doi
+        if not doi_url.startswith("http"):
+            doi_url = DOI_URL + doi_url
         try:
-            r = requests.get(url + recordID, params=params, timeout=options.timeout)
+            # only the final URL is needed, not the landing page itself
+            r = get_session().head(
+                doi_url, allow_redirects=True, timeout=options.timeout
+            )
+            if not r.ok:  # some servers do not answer HEAD requests
+                r = get_session().get(doi_url, timeout=options.timeout)
         except requests.exceptions.ConnectTimeout:
-            eprint("Connection timeout during metadata reading.")
+            eprint("Connection timeout.")
             if exceptions:
                 raise
             else:
                 sys.exit(1)
         except Exception:
-            eprint("Connection error during metadata reading.")
+            eprint("Connection error.")
             if exceptions:
                 raise
             else:
                 sys.exit(1)
+        if not r.ok:
+            eprint("DOI could not be resolved. Try again, or use record ID.")
+            if exceptions:
+                raise ValueError("DOI", options.doi)
+            else:
+                sys.exit(1)
+
+        recordID = PurePosixPath(urlparse(r.url).path).name
+    recordID = recordID.strip()
+
+    try:
+        if js is None:
+            js = fetch_metadata(
+                url,
+                recordID,
+                params=params,
+                timeout=options.timeout,
+                cache_dir=cache_dir,
+            )
+    except requests.exceptions.ConnectTimeout:
+        eprint("Connection timeout during metadata reading.")
+        if exceptions:
+            raise
+        else:
+            sys.exit(1)
+    except Exception:
+        eprint("Connection error during metadata reading.")
+        if exceptions:
+            raise
+        else:
+            sys.exit(1)
 
-        if r.ok:
-            js = r.json()
+    if js is not None:
+        globs = options.glob or ["*"]
+        if "*" in globs:  # every file is selected
+            files = list(map(file_entry, js["files"]))
+        else:
+            # same semantics as fnmatch.fnmatch, but translated only once,
+            # and all the globs are matched by a single regex
+            match = re.compile(
+                "|".join(f"(?:{translate(os.path.normcase(glob))})" for glob in globs)
+            ).match
             files = [
                 f
-                for f in js["files"]
-                if fnmatch(f.get("filename") or f["key"], options.glob)
+                for f in map(file_entry, js["files"])
+                if match(os.path.normcase(f.name))
             ]
-            if not files:
-                eprint("Files {} not found in metadata".format(options.glob))
-
-            total_size = sum((f.get("filesize") or f["size"]) for f in files)
-
-            if options.md5 is not None:
-                with open("md5sums.txt", "wt") as md5file:
-                    for f in files:
-                        fname = f.get("filename") or f["key"]
-                        checksum = f["checksum"].split(":")[-1]
-                        md5file.write(f"{checksum}  {fname}\n")
-
-            if options.wget is not None:
-                if options.wget == "-":
-                    for f in files:
-                        fname = f.get("filename") or f["key"]
-                        link = "https://zenodo.org/records/{}/files/{}".format(
-                            recordID, fname
-                        )
-                        print(link)
-                else:
-                    with open(options.wget, "wt") as wgetfile:
-                        for f in files:
-                            fname = f.get("filename") or f["key"]
-                            link = "https://zenodo.org/records/{}/files/{}".format(
-                                recordID, fname
-                            )
-                            wgetfile.write(link + "\n")
+        if not files:
+            eprint("Files {} not found in metadata".format(" ".join(globs)))
+
+        if options.md5 is not None:
+            with open(options.outdir / "md5sums.txt", "wt") as md5file:
+                md5file.write("".join(f"{f.checksum}  {f.name}\n" for f in files))
+
+        if options.wget is not None:
+            links = "".join(
+                "https://zenodo.org/records/{}/files/{}\n".format(recordID, f.name)
+                for f in files
+            )
+            if options.wget == "-":
+                sys.stdout.write(links)
             else:
-                eprint("Title: {}".format(js["metadata"]["title"]))
-                eprint("Keywords: " + (", ".join(js["metadata"].get("keywords", []))))
-                eprint("Publication date: " + js["metadata"]["publication_date"])
-                eprint("DOI: " + js["metadata"]["doi"])
-                eprint(f"Total size: {humanize.naturalsize(total_size)}")
-
-                for f in files:
-                    if abort_signal:
-                        eprint("Download aborted with CTRL+C.")
-                        eprint("Already successfully downloaded files are kept.")
-                        break
-
-                    fname = f.get("filename") or f["key"]
-                    link = "https://zenodo.org/records/{}/files/{}".format(
-                        recordID, fname
-                    )
+                with open(options.outdir / options.wget, "wt") as wgetfile:
+                    wgetfile.write(links)
+        else:
+            eprint("Title: {}".format(js["metadata"]["title"]))
+            eprint("Keywords: " + (", ".join(js["metadata"].get("keywords", []))))
+            eprint("Publication date: " + js["metadata"]["publication_date"])
+            eprint("DOI: " + js["metadata"]["doi"])
 
-                    size = humanize.naturalsize(f.get("filesize") or f["size"])
-                    eprint()
-                    eprint(f"Link: {link}   size: {size}")
-                    fname = f.get("filename") or f["key"]
-                    checksum = f["checksum"].split(":")[-1]
+            total_size = sum(f.size for f in files)
+            eprint(f"Total size: {naturalsize(total_size)}")
+
+            # file names may contain directories, create each only once
+            for parent in {os.path.dirname(f.name) for f in files} - {""}:
+                os.makedirs(options.outdir / parent, exist_ok=True)
+
+            known_file = verified_cache(options.outdir)
+            try:
+                known = json.loads(known_file.read_bytes())
+            except (OSError, ValueError):
+                known = {}
 
-                    remote_hash, local_hash = check_hash(fname, checksum)
+            # existing files are checked up front, in parallel, since
+            # hashlib releases the GIL while hashing
+            if options.cont:
+                with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+                    verified = list(
+                        pool.map(lambda f: verify_file(f, known, options.outdir), files)
+                    )
+            else:
+                verified = [False] * len(files)
+
+            pool = ThreadPoolExecutor(max_workers=options.jobs)
+            with save_on_exit(known_file, known), pool:
+                if options.jobs > 1:
+                    # the bars of the files would overwrite each other
+                    progress = total_progress(
+                        sum(f.size for f, ok in zip(files, verified) if not ok)
+                    )
+                    futures = [
+                        pool.submit(
+                            fetch_file, f, recordID, options, params, ok, progress
+                        )
+                        for f, ok in zip(files, verified)
+                    ]
+                    results = (future.result() for future in as_completed(futures))
+                else:  # keep the output of the files in order
+                    futures = []
+                    results = (
+                        fetch_file(f, recordID, options, params, ok)
+                        for f, ok in zip(files, verified)
+                    )
 
-                    if remote_hash == local_hash and options.cont:
-                        eprint(f"{fname} is already downloaded correctly.")
+                for fname, checksum, status, digest in results:
+                    if status == "aborted" or status == "skipped":
                         continue
 
-                    for _ in range(options.retry + 1):
-                        try:
-                            link = url = unquote(link)
-                            filename = wget.download(
-                                f"{link}?access_token={options.access_token}"
-                            )
-                        except Exception:
-                            eprint(f"  Download error. Original link: {link}")
-                            time.sleep(options.pause)
-                        else:
-                            break
-                    else:
-                        eprint("  Too many errors.")
+                    if status == "failed":
+                        eprint(f"  Too many errors. ({fname})")
                         if not options.error:
                             eprint("  Download is aborted.")
+                            stop_downloads(futures)
                             if exceptions:
                                 raise Exception("too  many errors")
                             else:
@@ -405,26 +1056,30 @@ def zenodo_get(argv=None):
                         eprint("  Download continues with the next file.")
                         continue
 
-                    if fname != filename:
-                        os.rename(filename, fname)
                     eprint()
-                    h1, h2 = check_hash(fname, checksum)
+                    h1, h2 = checksum, digest
                     if h1 == h2:
                         eprint(f"Checksum is correct. ({h1})")
+                        known[fname] = file_stamp(options.outdir / fname, checksum)
                     else:
                         eprint(f"Checksum is INCORRECT!({h1} got:{h2})")
                         if not options.keep:
                             eprint("  File is deleted.")
-                            os.remove(fname)
+                            os.remove(options.outdir / fname)
                         else:
                             eprint("  File is NOT deleted!")
                         if not options.error:
+                            stop_downloads(futures)
                             sys.exit(1)
-                else:
-                    eprint("All files have been downloaded.")
-        else:
-            eprint("Record could not get accessed.")
-            if exceptions:
-                raise Exception("Record could not get accessed.")
+
+            if abort_signal.is_set():
+                eprint("Download aborted with CTRL+C.")
+                eprint("Already successfully downloaded files are kept.")
             else:
-                sys.exit(1)
+                eprint("All files have been downloaded.")
+    else:
+        eprint("Record could not get accessed.")
+        if exceptions:
+            raise Exception("Record could not get accessed.")
+        else:
+            sys.exit(1)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 from time import time
+from collections import OrderedDict
 import json
 
 from functools import lru_cache as cache
@@ -10,98 +11,124 @@ import sys
 
 try:
     import requests
-    from box import SBox
+    import yaml
     from fuse import FUSE, Operations, LoggingMixIn
+    from zenodo_get.zget import CACHE_DIR, fetch_metadata, get_session
 except ImportError as e:
     logging.getLogger().critical(e)
-    logging.getLogger().critical("You need to install python-box, requests and fusepy.")
+    logging.getLogger().critical(
+        "You need to install pyyaml, requests, fusepy and zenodo_get."
+    )
     sys.exit(1)
 
 
+# shared by metadata queries and file reads, so connections are reused
+session = get_session()
+
+
+class ByteCache:
+    # contents by URL, the least recently used ones are dropped first
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.size = 0
+        self.items = OrderedDict()
+
+    def get(self, key):
+        data = self.items.get(key)
+        if data is not None:
+            self.items.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.limit:  # it would push out everything else
+            return
+        if key in self.items:
+            self.size -= len(self.items.pop(key))
+        self.items[key] = data
+        self.size += len(data)
+        while self.size > self.limit:
+            _, old = self.items.popitem(last=False)
+            self.size -= len(old)
+
+
+# small files are downloaded at once, and kept after they are closed
+small_files = ByteCache(64 << 20)
+
+
 class WebFile:
 
-    def __init__(self, url, size, chunksize=64, largefile=1024):
+    def __init__(self, url, size, chunksize=1024, largefile=1024):
         self.url = url
         self.r = None
         self.content = None
         if url is not None and size < (largefile * 1024):
-            with requests.get(url, stream=False) as r:
-                self.content = r.content
-        self.chunksize = 64
-        self.last_page = bytearray()
-        self.last_offset = 0
-        self.iterator = None
-
-    def reset(self):
-        self.last_offset = 0
-        self.r = requests.get(self.url, stream=True)
-        self.iterator = self.r.iter_content(chunk_size=self.chunksize * 1024)
+            self.content = small_files.get(url)
+            if self.content is None:
+                with session.get(url, stream=False) as r:
+                    self.content = r.content
+                    if r.ok:
+                        small_files.put(url, self.content)
+        self.chunksize = chunksize
+        self.offset = 0
+
+    def reset(self, offset=0):
+        # reopen the stream at the offset, if the server supports ranges
+        if self.r is not None:  # give the connection back to the pool
+            self.r.close()
+        headers = {"Accept-Encoding": "identity"}
+        if offset > 0:
+            headers["Range"] = f"bytes={offset}-"
+        self.r = session.get(self.url, headers=headers, stream=True)
+        self.offset = offset if self.r.status_code == 206 else 0
 
     def close(self):
-        self.last_offset = 0
-        self.last_page = bytearray()
+        self.offset = 0
+        if self.r is not None:
+            self.r.close()
         self.r = None
-        self.iterator = None
-
-    def read_next(self):
-        try:
-            if self.iterator is None:
-                self.reset()
-            self.last_offset += len(self.last_page)
-            self.last_page = next(self.iterator)
-            return self.last_page
-
-        except StopIteration:
-            return bytearray()
 
     def __getitem__(self, domain):
         if self.content is not None:
             return self.content[domain]
 
-        if domain.start > domain.stop:
+        if domain.start >= domain.stop:
             return bytes()
 
-        response = bytes()
-
-        if self.last_offset > domain.start:
-            self.reset()
-
-        if self.last_offset <= domain.start + len(self.last_page):
-            while self.last_offset + len(self.last_page) <= domain.start:
-                chunk = self.read_next()
-                if len(chunk) == 0:
-                    break
-
-            L = self.last_offset + len(self.last_page)
-            end = max(min(domain.stop, L) - self.last_offset, 0)
-
-            if end <= 0:
+        # the stream only goes forward, a short gap is read and dropped
+        gap = domain.start - self.offset
+        if self.r is None or gap < 0 or gap > self.chunksize * 1024:
+            self.reset(domain.start)
+        while self.offset < domain.start:
+            skipped = self.r.raw.read(min(domain.start - self.offset, 1 << 20))
+            if not skipped:  # beyond the end of the file
                 return bytes()
+            self.offset += len(skipped)
 
-            start = domain.start - self.last_offset
-            response = response + self.last_page[start:end]
-
-            N = max(end - start, 0)
-
-            if domain.start + N < domain.stop:
-                response = response + self[domain.start + N : domain.stop]
-        return response
+        data = self.r.raw.read(domain.stop - domain.start)
+        self.offset += len(data)
+        return data
 
 
 class ZenodoFS(LoggingMixIn, Operations):
 
-    def __init__(self, recordIDs, sandbox_recordIDs, chunksize=64, largefile=1024):
+    def __init__(self, recordIDs, sandbox_recordIDs, chunksize=1024, largefile=1024):
         self.records = {
             "sandbox": [],
             "zenodo": [],
         }
-        self.attr_cache = SBox(default_box=True)
-        self.dir_cache = SBox(default_box=True)
+        self.attr_cache = {}
+        self.tree = {"/sandbox": set(), "/zenodo": set()}  # directory -> names
         self.open_files = {}
         self.content = {}
         self.chunksize = chunksize
         self.largefile = largefile
         self.logger = logging.getLogger()
+        # records do not change, every entry gets the time of the mount
+        now = time()
+        times = {"st_ctime": now, "st_mtime": now, "st_atime": now}
+        self.dir_stat = {"st_mode": S_IFDIR | 0o755, "st_nlink": 2, **times}
+        self.file_stat = {"st_mode": S_IFREG | 0o444, "st_size": 0, **times}
         for rid in recordIDs:
             self.get_metadata(rid, sandbox=False)
         for rid in sandbox_recordIDs:
@@ -114,8 +141,13 @@ class ZenodoFS(LoggingMixIn, Operations):
         else:
             url = "https://sandbox.zenodo.org/api/records/"
 
+        # a record which did not change since the last mount is not sent again,
+        # the cache is shared with zenodo_get
+        path = "zenodo" if not sandbox else "sandbox"
         try:
-            r = requests.get(url + recordID, timeout=timeout)
+            record = fetch_metadata(
+                url, recordID, timeout=timeout, cache_dir=CACHE_DIR / path
+            )
         except requests.exceptions.ConnectTimeout:
             self.logger.critical("Connection timeout during metadata reading.")
             raise
@@ -124,87 +156,65 @@ class ZenodoFS(LoggingMixIn, Operations):
             raise
 
         js = {}
-        if r.ok:
-            js = json.loads(r.text)["files"]
-            for f in json.loads(r.text)["files"]:
-                path = "zenodo" if not sandbox else "sandbox"
-                self.attr_cache[f'/{path}/{recordID}/{f["key"]}'] = SBox(
-                    f, default_box=True
-                )
+        if record is not None:
+            js = record["files"]
+            self.add_path(f"/{path}/{recordID}.json")
+            self.add_path(f"/{path}/{recordID}.yaml")
+            self.tree.setdefault(f"/{path}/{recordID}", set())
+            self.add_path(f"/{path}/{recordID}")
+            for f in js:
+                name = f'/{path}/{recordID}/{f["key"]}'
+                self.attr_cache[name] = f
+                self.add_path(name)
 
             self.content[f"/{path}/{recordID}.json"] = (
-                SBox(metadata=js).to_json() + "\n"
+                json.dumps({"metadata": js}, ensure_ascii=False) + "\n"
+            ).encode()
+            self.content[f"/{path}/{recordID}.yaml"] = yaml.safe_dump(
+                {"metadata": js}, default_flow_style=False
             ).encode()
-            self.content[f"/{path}/{recordID}.yaml"] = (
-                SBox(metadata=js).to_yaml().encode()
-            )
         return js
 
+    def add_path(self, path):
+        # register the path in its parent directory, and the parents as well
+        while path.count("/") > 1:
+            parent, _, name = path.rpartition("/")
+            children = self.tree.setdefault(parent, set())
+            if name in children:
+                break
+            children.add(name)
+            path = parent
+
     def readdir(self, path, fh):
-        level = len(path.split("/"))
-        content = [name for name in self.attr_cache.keys() if name.startswith(path)]
         if path == "/":
             return [".", "sandbox", "zenodo"]
 
-        elif path in ("/sandbox", "/zenodo"):
-            content = [name for name in self.attr_cache.keys() if name.startswith(path)]
-        else:
-            parts = path.split("/")
-            if len(parts) >= 3:
-                recordID = parts[2]
-                self.get_metadata(recordID)
-                content = [
-                    name for name in self.attr_cache.keys() if name.startswith(path)
-                ]
-
-        N = len(path) + 1
-        content = list(
-            {
-                name[N:].split("/")[0]
-                for name in content
-                if len(name) > N and name[N - 1] == "/"
-            }
-        )
-        if level == 2:
-            content = (
-                content
-                + [f"{name}.yaml" for name in content if name.find(".") == -1]
-                + [f"{name}.json" for name in content if name.find(".") == -1]
-            )
-        return list(set(content))
+        parts = path.split("/")
+        if len(parts) >= 3:
+            self.get_metadata(parts[2], sandbox=parts[1] == "sandbox")
+        return list(self.tree.get(path, ()))
 
     def getattr(self, path, fh=None):
         parts = path.split("/")
         level = len(parts)
-        st = {}
         if path in ["/", "/sandbox", "/zenodo"]:
-            st["st_mode"] = S_IFDIR | 0o755
-            st["st_nlink"] = 2
+            return self.dir_stat
         elif level == 3:
             if path.find(".") > -1:
-                size = len(self.content[path])
-                st = {"st_mode": (S_IFREG | 0o444), "st_size": size}
-            else:
-                st["st_mode"] = S_IFDIR | 0o755
-                st["st_nlink"] = 2
-        else:
-            size = 0
-            st = {"st_mode": (S_IFREG | 0o444), "st_size": size}
-            if level >= 3:
-                recordID = parts[2]
-                self.get_metadata(recordID)
-
-            if level == 4:
-                fn = self.attr_cache[path]
-                if "size" in fn:
-                    st["st_size"] = fn["size"]
-        st["st_ctime"] = st["st_mtime"] = st["st_atime"] = time()
-        return st
+                return {**self.file_stat, "st_size": len(self.content[path])}
+            return self.dir_stat
+
+        self.get_metadata(parts[2], sandbox=parts[1] == "sandbox")
+        if path in self.tree:  # a directory inside a record
+            return self.dir_stat
+        fn = self.attr_cache.get(path, {})
+        return {**self.file_stat, "st_size": fn.get("size", 0)}
 
     def open(self, path, mode):
         if path not in self.open_files:
-            url = self.attr_cache[path]["links"].get("self")
-            size = self.attr_cache[path].get("size", 0)
+            fn = self.attr_cache.get(path, {})
+            url = fn.get("links", {}).get("self")
+            size = fn.get("size", 0)
             self.open_files[path] = WebFile(url, size, self.chunksize, self.largefile)
         return 0
 
@@ -241,8 +251,8 @@ if __name__ == "__main__":
         "-c",
         "--chunk_size",
         type=int,
-        default=64,
-        help="chunk size [KB] for network download (default: 64)",
+        default=1024,
+        help="chunk size [KB] for network download, shorter forward seeks are read through (default: 1024)",
     )
     parser.add_argument(
         "-l",
@@ -252,6 +262,14 @@ if __name__ == "__main__":
         help="file size [KB] which is downloaded without splitting into chunks (default: 256)",
     )
 
+    parser.add_argument(
+        "-C",
+        "--cache_size",
+        type=int,
+        default=64,
+        help="memory [MB] for keeping small files after they are closed (default: 64)",
+    )
+
     parser.add_argument(
         "-L",
         "--log_level",
@@ -276,6 +294,7 @@ if __name__ == "__main__":
     }[args.log_level]
 
     logging.basicConfig(level=level)
+    small_files.limit = args.cache_size << 20
 
     fuse = FUSE(
         ZenodoFS(